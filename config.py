@@ -1,29 +1,69 @@
 import os
+import functools
+from pathlib import Path
+from dataclasses import dataclass
 
 from dotenv import load_dotenv
 
 
-load_dotenv()
+@dataclass(frozen=True, slots=True)
+class Pattern:
+    artist: int
+    title: int
+    separator: str
 
 
+@dataclass(frozen=True, slots=True)
 class Config:
     # Spotify credentials
-    SPOTIFY_CLIENT_ID = os.environ.get("SPOTIFY_CLIENT_ID") or "client-id"
-    SPOTIFY_CLIENT_SECRET = os.environ.get("SPOTIFY_CLIENT_SECRET") or "client-secret"
+    SPOTIFY_CLIENT_ID: str
+    SPOTIFY_CLIENT_SECRET: str
 
     # FFMPEG path
-    FFMPEG_PATH = os.environ.get("FFMPEG_PATH") or "/usr/bin/ffmpeg"
+    FFMPEG_PATH: str
 
     # Chrome bookmarks
-    CHROME_BOOKMARK_PATH = os.environ.get("CHROME_BOOKMARK_PATH")
-    BOOKMARK_POSITION = int(os.environ.get("BOOKMARK_POSITION", 0))
+    CHROME_BOOKMARK_PATH: str
+    BOOKMARK_POSITION: int
 
     # Music directory
-    MUSIC_DIRECTORY = os.environ.get("MUSIC_DIRECTORY") or "downloaded_musics"
+    MUSIC_DIRECTORY: str
+
+    # Number of tracks processed concurrently
+    MAX_WORKERS: int
+
+    # Number of concurrent Spotify searches (kept low to stay under the rate limit)
+    SPOTIFY_WORKERS: int
+
+    # Lifetime of the Spotify metadata cache entries
+    SPOTIFY_CACHE_TTL_DAYS: int
 
     # Naming Pattern
-    NAMING_PATTERN = dict(
-        title=int(os.environ.get("TITLE_POSITION", 1)),
-        artist=int(os.environ.get("ARTIST_POSITION", 0)),
-        separator=os.environ.get("MUSIC_SEPARATOR") or " - ",
+    NAMING_PATTERN: Pattern
+
+
+@functools.cache
+def get_config() -> Config:
+    load_dotenv()
+
+    config = Config(
+        SPOTIFY_CLIENT_ID=os.environ.get("SPOTIFY_CLIENT_ID") or "client-id",
+        SPOTIFY_CLIENT_SECRET=os.environ.get("SPOTIFY_CLIENT_SECRET") or "client-secret",
+        FFMPEG_PATH=os.environ.get("FFMPEG_PATH") or "/usr/bin/ffmpeg",
+        CHROME_BOOKMARK_PATH=os.environ.get("CHROME_BOOKMARK_PATH"),
+        BOOKMARK_POSITION=int(os.environ.get("BOOKMARK_POSITION", 0)),
+        MUSIC_DIRECTORY=os.environ.get("MUSIC_DIRECTORY") or "downloaded_musics",
+        MAX_WORKERS=int(os.environ.get("MAX_WORKERS", 8)),
+        SPOTIFY_WORKERS=int(os.environ.get("SPOTIFY_WORKERS", 5)),
+        SPOTIFY_CACHE_TTL_DAYS=int(os.environ.get("SPOTIFY_CACHE_TTL_DAYS", 180)),
+        NAMING_PATTERN=Pattern(
+            title=int(os.environ.get("TITLE_POSITION", 1)),
+            artist=int(os.environ.get("ARTIST_POSITION", 0)),
+            separator=os.environ.get("MUSIC_SEPARATOR") or " - ",
+        ),
     )
+
+    # Ensure music directory exists
+    Path(config.MUSIC_DIRECTORY).mkdir(parents=True, exist_ok=True)
+
+    return config
@@ -3,24 +3,112 @@ from __future__ import annotations
 import re
 import os
 import json
-import subprocess
-from dataclasses import dataclass
-from typing import List, Optional, Dict, TypedDict
+import time
+import sqlite3
+import logging
+import hashlib
+import argparse
+import itertools
+import threading
+import importlib.util
+from pathlib import Path
+from dataclasses import dataclass, field, asdict
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from typing import List, Optional, Dict, Tuple, Iterator, Callable, TypedDict
 
 import yt_dlp
 import spotipy
 import requests
-from mutagen.mp3 import MP3
+from urllib3.util.retry import Retry
+from requests.adapters import HTTPAdapter
 from rich.console import Console
+from rich.logging import RichHandler
 from spotipy.oauth2 import SpotifyClientCredentials
+from spotipy.exceptions import SpotifyException
+from spotipy.cache_handler import CacheFileHandler
 from rich.progress import Progress, TaskID, SpinnerColumn
-from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, TYER
+from mutagen import MutagenError
+from mutagen.id3 import ID3, ID3NoHeaderError, APIC, TIT2, TPE1, TPE2, TALB, TYER
 
-from config import Config
+from config import Config, Pattern, get_config
+
+
+# Optional streaming JSON parser for large Chrome bookmarks files
+if importlib.util.find_spec("ijson"):
+    import ijson
+else:
+    ijson = None
+
+# Optional fast JSON parser, used when the bookmarks file is not streamed
+if importlib.util.find_spec("orjson"):
+    import orjson
+else:
+    orjson = None
+
+# Optional native (bit-parallel) Levenshtein implementation
+if importlib.util.find_spec("rapidfuzz"):
+    from rapidfuzz import process as rapidfuzz_process
+    from rapidfuzz.distance import Levenshtein
+else:
+    rapidfuzz_process = None
+
+
+def levenshtein_similarity(s1: str, s2: str, score_cutoff: float = 0.0) -> float:
+    """ Pure-Python `rapidfuzz.distance.Levenshtein.normalized_similarity`, returns 0 below `score_cutoff` """
+
+    max_len = max(len(s1), len(s2))
+    if max_len == 0:
+        return 1.0
+
+    # Highest distance still reaching `score_cutoff` (epsilon absorbs float rounding), the length
+    # difference being a lower bound of the distance
+    max_dist = int(max_len * (1 - score_cutoff) + 1e-9)
+    if abs(len(s1) - len(s2)) > max_dist:
+        return 0.0
+
+    # Only two rows of the DP matrix are kept, sized on the shortest string
+    if len(s1) < len(s2):
+        s1, s2 = s2, s1
+
+    prev = list(range(len(s2) + 1))
+    for i, c1 in enumerate(s1, 1):
+        cur = [i]
+        for j, c2 in enumerate(s2, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (c1 != c2)))
+        if min(cur) > max_dist:
+            return 0.0
+        prev = cur
+
+    return 1 - prev[-1] / max_len if prev[-1] <= max_dist else 0.0
+
+
+def best_match_index(query: str, choices: List[str]) -> int:
+    """ Index of the choice most similar to `query` (normalized Levenshtein), the first one on ties """
+
+    if rapidfuzz_process is not None:
+        return rapidfuzz_process.extractOne(query, choices, scorer=Levenshtein.normalized_similarity)[2]
+
+    # The best score so far is the cutoff, so hopeless choices are abandoned early
+    best_index, best_score = 0, 0.0
+    for index, choice in enumerate(choices):
+        score = levenshtein_similarity(query, choice, score_cutoff=best_score)
+        if score > best_score:
+            best_index, best_score = index, score
+    return best_index
 
 
 # Initialize Rich console
 console = Console()
+logger = logging.getLogger(__name__)
+
+# ID3 text encoding (UTF-8)
+ID3_ENCODING = 3
+
+# Release dates start with the year (`YYYY`, `YYYY-MM` or `YYYY-MM-DD`), Spotify uses `0000` when unknown
+RELEASE_YEAR = re.compile(r"(?!0000)\d{4}")
+
+# Characters not allowed in file names (Windows being the strictest)
+UNSAFE_FILENAME_CHARS = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
 
 
 class ChromeBookmark(TypedDict):
@@ -28,151 +116,457 @@ class ChromeBookmark(TypedDict):
     name: str
 
 
-class Pattern(TypedDict):
-    artist: int
-    title: int
-    separator: str
-
-
-@dataclass
+@dataclass(frozen=True)
 class Track:
     url: str
     name: str
     title: str
     artist: str
+    safe_name: str = field(init=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "safe_name", UNSAFE_FILENAME_CHARS.sub("_", self.name).strip()[:200])
 
     @classmethod
     def from_chrome_bookmark(cls, bookmark: ChromeBookmark, pattern: Pattern) -> Track:
-        parts = bookmark["name"].split(pattern["separator"])
+        # Normalized once here so searches, cache keys and artist matching all agree
+        parts = [part.strip() for part in bookmark["name"].split(pattern.separator)]
         return cls(
             url=bookmark["url"],
             name=bookmark["name"],
-            title=parts[pattern["title"]],
-            artist=parts[pattern["artist"]],
+            title=parts[pattern.title],
+            artist=parts[pattern.artist],
         )
 
 
 @dataclass
 class TrackMetadata:
-    year: str
+    year: Optional[str]
     title: str
     album: str
     artist: str
     cover_url: str = None
+    album_artist: str = None
+    spotify_id: str = None
+
+
+class MetadataCache:
+    """ Persistent SQLite cache of Spotify metadata keyed by all the search parameters """
+
+    def __init__(self, path: Path, ttl: int):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, payload TEXT, ts INTEGER)")
+
+    @staticmethod
+    def _key(query: str, limit: int) -> str:
+        return hashlib.sha1(f"{query}\x00{limit}".lower().encode()).hexdigest()
+
+    def get(self, query: str, limit: int) -> Tuple[bool, Optional[TrackMetadata]]:
+        """ (cached, metadata), the metadata being `None` for a cached "no match" """
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM meta WHERE key = ? AND ts > ?",
+                (self._key(query, limit), int(time.time()) - self.ttl),
+            ).fetchone()
+        if not row:
+            return False, None
+        payload = json.loads(row[0])
+        return True, TrackMetadata(**payload) if payload else None
+
+    def get_expired(self, query: str, limit: int) -> Optional[TrackMetadata]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM meta WHERE key = ? AND ts <= ?",
+                (self._key(query, limit), int(time.time()) - self.ttl),
+            ).fetchone()
+        payload = json.loads(row[0]) if row else None
+        return TrackMetadata(**payload) if payload else None
+
+    def set(self, query: str, limit: int, metadata: Optional[TrackMetadata]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta(key, payload, ts) VALUES (?, ?, ?)",
+                (self._key(query, limit), json.dumps(asdict(metadata) if metadata else None), int(time.time())),
+            )
 
 
 class MusicDownloader:
-    def __init__(self, config: Config):
+    # Number of Spotify search results compared against the bookmarked artist
+    SEARCH_LIMIT = 10
+
+    # Maximum number of ids accepted by Spotify's `tracks` endpoint
+    TRACKS_BATCH_SIZE = 50
+
+    def __init__(self, config: Config, refresh: bool = False):
         self.config = config
-        self.spotify = spotipy.Spotify(
-            auth_manager=SpotifyClientCredentials(
-                client_id=config.SPOTIFY_CLIENT_ID,
-                client_secret=config.SPOTIFY_CLIENT_SECRET,
-            )
+        self.refresh = refresh
+        self.music_root = Path(config.MUSIC_DIRECTORY)
+        self.auth_manager = SpotifyClientCredentials(
+            client_id=config.SPOTIFY_CLIENT_ID,
+            client_secret=config.SPOTIFY_CLIENT_SECRET,
+            # Token (valid 1 hour) reused across runs, file only readable by its owner (spotipy >= 2.25.1)
+            cache_handler=CacheFileHandler(cache_path=str(self.music_root / ".spotify_token.json")),
         )
 
-        # Ensure music directory exists
-        os.makedirs(config.MUSIC_DIRECTORY, exist_ok=True)
+        # Per-thread state: Spotify clients, YoutubeDL instances and the track being downloaded
+        self._local = threading.local()
+
+        # One connection per concurrent thread: MAX_WORKERS metadata lookups and MAX_WORKERS cover fetches
+        self.session = self._build_session(pool_size=2 * config.MAX_WORKERS)
+
+        # Bounds concurrent Spotify searches, whichever thread issues them
+        self._spotify_slots = threading.BoundedSemaphore(config.SPOTIFY_WORKERS)
+
+        # Covers are fetched in the background while the audio is downloaded
+        self._cover_executor = ThreadPoolExecutor(max_workers=config.MAX_WORKERS)
+
+        # In-process metadata cache keyed by (title, artist)
+        self._metadata_cache: Dict[Tuple[str, str], Optional[TrackMetadata]] = {}
+
+        # Metadata cache persisted across runs
+        self.metadata_cache = MetadataCache(
+            path=self.music_root / ".spotify_cache.sqlite",
+            ttl=config.SPOTIFY_CACHE_TTL_DAYS * 86400,
+        )
 
-        # Setup yt-dlp
+        # Setup yt-dlp: audio extraction to MP3 is done by its ffmpeg postprocessor in the same run.
+        # MP3 streams are preferred when offered since they are copied as-is, others are encoded
+        # with LAME VBR quality 2 (~190 kb/s). Cores are shared between the concurrent ffmpeg runs.
+        ffmpeg_threads = max(1, (os.cpu_count() or 1) // config.MAX_WORKERS)
         self.yt_options = dict(
             quiet=True,
-            extractaudio=True,
-            format="bestaudio/best",
+            format="bestaudio[acodec=mp3]/bestaudio/best",
             ffmpeg_location=config.FFMPEG_PATH,
+            postprocessors=[dict(key="FFmpegExtractAudio", preferredcodec="mp3", preferredquality="2")],
+            # No stats nor info logs: yt-dlp buffers ffmpeg's stderr and only reports its last line on error
+            postprocessor_args=dict(
+                extractaudio=["-ar", "44100", "-threads", str(ffmpeg_threads), "-nostats", "-loglevel", "error"],
+            ),
         )
 
+    @staticmethod
+    def _build_session(pool_size: int) -> requests.Session:
+        """ Keep-alive HTTP session shared by all threads for Spotify calls and cover downloads """
+
+        retries = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            respect_retry_after_header=True,
+        )
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_maxsize=pool_size, max_retries=retries))
+        return session
+
+    @property
+    def spotify(self) -> spotipy.Spotify:
+        if not hasattr(self._local, "spotify"):
+            self._local.spotify = spotipy.Spotify(auth_manager=self.auth_manager, requests_session=self.session)
+        return self._local.spotify
+
     def get_bookmarked_tracks(self) -> List[Track]:
-        with open(self.config.CHROME_BOOKMARK_PATH) as fp:
-            bookmarks = json.load(fp)
+        return [Track.from_chrome_bookmark(bm, self.config.NAMING_PATTERN) for bm in self._iter_music_folder()]
+
+    def mp3_path(self, track: Track) -> Path:
+        return self.music_root / f"{track.safe_name}.mp3"
+
+    def is_tagged(self, track: Track) -> bool:
+        """ Whether the MP3 exists and already holds the tags written by a previous run """
+
+        try:
+            tags = ID3(self.mp3_path(track))
+        except ID3NoHeaderError:
+            tags = ID3()
+        except MutagenError:
+            # Missing file or damaged ID3 header
+            return False
+
+        # Spotify had no match: nothing can be added to the downloaded file
+        cached, metadata = self.metadata_cache.get(self._search_query(track), self.SEARCH_LIMIT)
+        if cached and metadata is None:
+            return True
+
+        # A cover is only written when the Spotify album has one
+        if "TIT2" not in tags:
+            return False
+        return "APIC:Cover" in tags or not (metadata and metadata.cover_url)
 
-        music_folder = bookmarks["roots"]["bookmark_bar"]["children"][self.config.BOOKMARK_POSITION]["children"]
+    def filter_tracks(self, tracks: List[Track]) -> List[Track]:
+        """ Drop duplicated bookmarks and tracks already downloaded and tagged, before any network work """
 
-        return [Track.from_chrome_bookmark(bm, self.config.NAMING_PATTERN) for bm in music_folder]
+        seen_urls, seen_songs, seen_files, unique = set(), set(), set(), []
+        for track in tracks:
+            # Same song bookmarked twice (possibly from another upload), or names only differing by
+            # sanitized characters, which would make two workers write the same MP3
+            song = self._metadata_key(track)
+            if track.url in seen_urls or song in seen_songs or track.safe_name in seen_files:
+                console.print(f"[yellow]![/yellow] Skipping duplicated bookmark: '{track.name}'")
+                continue
+            seen_urls.add(track.url)
+            seen_songs.add(song)
+            seen_files.add(track.safe_name)
+
+            if self.is_tagged(track):
+                console.print(f"[yellow]![/yellow] Skipping already downloaded: '{track.name}'")
+                continue
+            unique.append(track)
+
+        return unique
+
+    def _iter_music_folder(self) -> Iterator[ChromeBookmark]:
+        position = self.config.BOOKMARK_POSITION
+
+        if ijson is None:
+            with open(self.config.CHROME_BOOKMARK_PATH, "rb") as fp:
+                data = fp.read()
+            bookmarks = orjson.loads(data) if orjson else json.loads(data)
+            yield from bookmarks["roots"]["bookmark_bar"]["children"][position]["children"]
+            return
+
+        # Stream the bookmark bar one folder at a time and stop at the music folder
+        with open(self.config.CHROME_BOOKMARK_PATH, "rb") as fp:
+            folders = ijson.items(fp, "roots.bookmark_bar.children.item")
+            music_folder = next(itertools.islice(folders, position, None), None)
+        if music_folder is None:
+            raise IndexError(f"No bookmark folder at position {position}")
+        yield from music_folder["children"]
+
+    @staticmethod
+    def _metadata_key(track: Track) -> Tuple[str, str]:
+        return track.title.lower(), track.artist.lower()
+
+    @staticmethod
+    def _search_query(track: Track) -> str:
+        return f"track {track.title} artist {track.artist}"
 
     def get_spotify_metadata(self, track: Track) -> Optional[TrackMetadata]:
-        results = self.spotify.search(q=f"track {track.title} artist {track.artist}", limit=10)
+        key = self._metadata_key(track)
+        if key not in self._metadata_cache:
+            query = self._search_query(track)
+            cached, metadata = (False, None) if self.refresh else self.metadata_cache.get(query, self.SEARCH_LIMIT)
+            if not cached:
+                try:
+                    metadata = self._search_spotify(track, query)
+                    # "No match" is cached as well, so re-runs do not search again
+                    self.metadata_cache.set(query, self.SEARCH_LIMIT, metadata)
+                except Exception as e:
+                    logger.error(f"Error retrieving Spotify metadata for '{track.name}': {e}")
+            self._metadata_cache[key] = metadata
+        return self._metadata_cache[key]
+
+    def get_spotify_metadata_bulk(self, tracks: List[Track]) -> Dict[Track, Optional[TrackMetadata]]:
+        # Duplicate bookmarks resolve to a single lookup. Track payloads already hold the
+        # album name, date and images, so no extra `albums` calls are needed.
+        unique_tracks = list({self._metadata_key(track): track for track in tracks}.values())
+        if not self.refresh:
+            self._refresh_expired_metadata(unique_tracks)
+
+        with ThreadPoolExecutor(max_workers=self.config.MAX_WORKERS) as executor:
+            list(executor.map(self.get_spotify_metadata, unique_tracks))
+
+        return {track: self.get_spotify_metadata(track) for track in tracks}
+
+    def _refresh_expired_metadata(self, tracks: List[Track]):
+        """ Refresh expired cache entries with a known Spotify id through batched `tracks` calls """
+
+        tracks_by_id: Dict[str, List[Track]] = {}
+        for track in tracks:
+            metadata = self.metadata_cache.get_expired(self._search_query(track), self.SEARCH_LIMIT)
+            if metadata and metadata.spotify_id:
+                tracks_by_id.setdefault(metadata.spotify_id, []).append(track)
+
+        ids = list(tracks_by_id)
+        for i in range(0, len(ids), self.TRACKS_BATCH_SIZE):
+            try:
+                results = self._call_with_backoff(self.spotify.tracks, ids[i:i + self.TRACKS_BATCH_SIZE])
+            except Exception as e:
+                # Not fatal: the batch falls back to a search per track
+                logger.error(f"Error refreshing Spotify metadata: {e}")
+                continue
+
+            # Unavailable ids come back as `None`: those tracks fall back to a search
+            for track_info in filter(None, results["tracks"]):
+                metadata = self._metadata_from_spotify(track_info)
+                for track in tracks_by_id.get(track_info["id"], []):
+                    self._metadata_cache[self._metadata_key(track)] = metadata
+                    self.metadata_cache.set(self._search_query(track), self.SEARCH_LIMIT, metadata)
+
+    def _search_spotify(self, track: Track, query: str) -> Optional[TrackMetadata]:
+        results = self._call_with_backoff(self.spotify.search, q=query, limit=self.SEARCH_LIMIT)
         if not results or not results["tracks"]["items"]:
             return None
 
-        track_info = results["tracks"]["items"][0]
+        # Spotify's first hit is not always by the bookmarked artist: keep the closest artist name
+        items = results["tracks"]["items"]
+        artists = [item["artists"][0]["name"].lower() for item in items]
+        return self._metadata_from_spotify(items[best_match_index(track.artist.lower(), artists)])
+
+    @staticmethod
+    def _metadata_from_spotify(track_info: Dict) -> TrackMetadata:
+        album = track_info["album"]
         return TrackMetadata(
             title=track_info["name"],
-            album=track_info["album"]["name"],
+            album=album["name"],
             artist=track_info["artists"][0]["name"],
-            year=track_info["album"]["release_date"][:4],
-            cover_url=track_info["album"]["images"][0]["url"] if track_info["album"]["images"] else None,
+            album_artist=album["artists"][0]["name"],
+            year=album["release_date"][:4] if RELEASE_YEAR.match(album["release_date"]) else None,
+            cover_url=album["images"][0]["url"] if album["images"] else None,
+            spotify_id=track_info["id"],
         )
 
-    def download_track(self, track: Track, task_id: TaskID, progress: Progress) -> bool:
-        def progress_hook(yt_dlp: Dict):
-            if yt_dlp["status"] == "downloading":
-                downloaded = yt_dlp.get("downloaded_bytes", 0)
-                total = yt_dlp.get("total_bytes") or yt_dlp.get("total_bytes_estimate", 0)
+    def _call_with_backoff(self, func: Callable, *args, max_attempts: int = 6, **kwargs) -> Optional[Dict]:
+        """ Retry rate-limited (429) Spotify calls, sleeping for the `Retry-After` delay sent by Spotify """
+
+        for attempt in range(max_attempts):
+            try:
+                with self._spotify_slots:
+                    return func(*args, **kwargs)
+            except SpotifyException as e:
+                if e.http_status != 429 or attempt == max_attempts - 1:
+                    raise
+                time.sleep(int((e.headers or {}).get("Retry-After", 2 ** attempt)))
+
+    @property
+    def ydl(self) -> yt_dlp.YoutubeDL:
+        """ Reusable YoutubeDL instance (one per thread), its hooks report to the thread's current track """
+
+        if not hasattr(self._local, "ydl"):
+            self._local.ydl = yt_dlp.YoutubeDL(dict(
+                self.yt_options,
+                progress_hooks=[self._progress_hook],
+                postprocessor_hooks=[self._postprocessor_hook],
+            ))
+        return self._local.ydl
+
+    def _progress_hook(self, yt_dlp: Dict):
+        track, task_id, progress = self._local.current
+        if yt_dlp["status"] == "downloading":
+            downloaded = yt_dlp.get("downloaded_bytes", 0)
+            total = yt_dlp.get("total_bytes") or yt_dlp.get("total_bytes_estimate", 0)
+
+            if total > 0:
+                progress.update(task_id, completed=downloaded, total=total)
+            progress.update(task_id, description=f"[green]Downloading: '{track.name}'")
+
+    def _postprocessor_hook(self, yt_dlp: Dict):
+        track, task_id, progress = self._local.current
+        if yt_dlp["status"] == "started" and yt_dlp["postprocessor"] == "ExtractAudio":
+            progress.update(task_id, description=f"[green]Converting: '{track.name}'")
+
+    def download_track(self, track: Track, task_id: TaskID, progress: Progress) -> Optional[Path]:
+        ydl = self.ydl
+        # `%` must be escaped, yt-dlp reads it as a template field
+        filename = track.safe_name.replace("%", "%%")
+        # Only the default template: the other ones (chapter, thumbnail, ...) set by yt-dlp stay intact
+        ydl.params["outtmpl"]["default"] = str(self.music_root / f"{filename}.%(ext)s")
+        self._local.current = (track, task_id, progress)
 
-                if total > 0:
-                    progress.update(task_id, completed=downloaded, total=total)
-                progress.update(task_id, description=f"[green]Downloading: '{track.name}'")
+        try:
+            info = ydl.extract_info(track.url, download=True)
+            return Path(info["requested_downloads"][0]["filepath"])
+        except Exception as e:
+            logger.error(f"Error downloading '{track.name}': {e}")
+            return None
+
+    def prefetch_cover(self, cover_url: str) -> Future:
+        return self._cover_executor.submit(self._download_cover, cover_url)
 
-        self.yt_options["outtmpl"] = f"{self.config.MUSIC_DIRECTORY}/{track.name}.%(ext)s"
-        self.yt_options["progress_hooks"] = [progress_hook]
+    def _download_cover(self, cover_url: str) -> Tuple[bytes, str]:
+        with self.session.get(cover_url, stream=True, timeout=10) as resp:
+            resp.raise_for_status()
 
+            # Spotify covers are usually JPEG: use the served type instead of assuming PNG
+            mime = resp.headers.get("Content-Type", "image/jpeg").split(";")[0].strip()
+
+            return resp.content, mime
+
+    def add_metadata(self, filepath: Path, metadata: TrackMetadata, cover: Optional[Tuple[bytes, str]] = None):
+        # Only the tags are touched: no need to parse the MPEG frames with `MP3`
         try:
-            with yt_dlp.YoutubeDL(self.yt_options) as ydl:
-                ydl.download([track.url])
-            return True
-        except Exception as e:
-            console.print(f"[red]Error downloading '{track.name}': {e}")
-            return False
+            tags = ID3(filepath)
+        except ID3NoHeaderError:
+            tags = ID3()
+
+        tags.add(TIT2(encoding=ID3_ENCODING, text=metadata.title))
+        tags.add(TPE1(encoding=ID3_ENCODING, text=metadata.artist))
+        tags.add(TALB(encoding=ID3_ENCODING, text=metadata.album))
+        if metadata.album_artist:
+            tags.add(TPE2(encoding=ID3_ENCODING, text=metadata.album_artist))
+        if metadata.year:
+            tags.add(TYER(encoding=ID3_ENCODING, text=metadata.year))
 
-    def convert_to_mp3(self, track: Track, task_id: TaskID, progress: Progress):
-        input_file = f"{self.config.MUSIC_DIRECTORY}/{track.name}.webm"
-        output_file = f"{self.config.MUSIC_DIRECTORY}/{track.name}.mp3"
+        if cover:
+            cover_data, mime = cover
+            tags.add(APIC(encoding=ID3_ENCODING, mime=mime, type=3, desc="Cover", data=cover_data))
 
-        # Get duration for progress tracking
-        probe_cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of",
-                     "default=noprint_wrappers=1:nokey=1", input_file]
-        duration = float(subprocess.check_output(probe_cmd).decode())
-        progress.update(task_id, description=f"[green]Converting: '{track.name}'", total=duration)
+        tags.save(filepath, v2_version=3)
 
-        cmd = ["ffmpeg", "-i", input_file, "-vn", "-ar", "44100", "-b:a", "192k", "-progress", "pipe:1", "-y", output_file]
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
 
-        for line in process.stdout:
-            if match := re.search(r"out_time_us=(\d+)", line):
-                progress.update(task_id, completed=int(match.group(1)) / 1000000)
+def resolve_cover(track: Track, cover: Optional[Future]) -> Optional[Tuple[bytes, str]]:
+    """ Wait for the prefetched cover, a failure only drops the cover and not the other tags """
 
-        process.wait()
-        os.remove(input_file)
+    if cover is None:
+        return None
 
-    def add_metadata(self, track_name: str, metadata: TrackMetadata):
-        filepath = f"{self.config.MUSIC_DIRECTORY}/{track_name}.mp3"
+    try:
+        return cover.result()
+    except Exception as e:
+        logger.error(f"Error downloading cover for '{track.name}': {e}")
+        return None
 
-        audio = MP3(filepath, ID3=ID3)
-        if not audio.tags:
-            audio.add_tags()
 
-        audio.tags.add(TIT2(encoding=3, text=metadata.title))
-        audio.tags.add(TPE1(encoding=3, text=metadata.artist))
-        audio.tags.add(TALB(encoding=3, text=metadata.album))
-        audio.tags.add(TYER(encoding=3, text=metadata.year))
+def process_track(downloader: MusicDownloader, track: Track, metadata: Optional[TrackMetadata], progress: Progress):
+    process_task = progress.add_task(f"[green]Processing: '{track.name}'", total=100)
 
-        if metadata.cover_url:
-            cover_data = requests.get(metadata.cover_url).content
-            audio.tags.add(APIC(encoding=3, mime="image/png", type=3, desc="Cover", data=cover_data))
+    # The cover URL is known from the metadata lookup: fetch it while yt-dlp works
+    cover = downloader.prefetch_cover(metadata.cover_url) if metadata and metadata.cover_url else None
 
-        audio.save()
+    try:
+        # An untagged MP3 left by a previous run only misses its metadata
+        filepath = downloader.mp3_path(track)
+        if not filepath.exists():
+            filepath = downloader.download_track(track, process_task, progress)
+
+        if filepath:
+            if metadata:
+                progress.update(process_task, description=f"[green]Adding metadata: '{track.name}'")
+                downloader.add_metadata(filepath, metadata, resolve_cover(track, cover))
+            else:
+                logger.warning(f"No Spotify metadata found: '{track.name}'")
+    except Exception as e:
+        # One failing track must not abort the rest of the batch
+        logger.error(f"Error processing '{track.name}': {e}")
+    finally:
+        if cover:
+            cover.cancel()
+        progress.remove_task(process_task)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Download music from Chrome bookmarks")
+    parser.add_argument("--refresh", action="store_true", help="Ignore the Spotify metadata cache")
+    args = parser.parse_args()
+
+    # Route log records through Rich so they render cleanly above the progress bars
+    logging.basicConfig(format="%(message)s", handlers=[RichHandler(console=console, show_path=False)])
+
     console.print("[blue]i[/blue] This script will download music from your bookmarks.")
     console.print("[blue]i[/blue] This script only works with Chrome bookmarks on Windows.")
 
-    downloader = MusicDownloader(Config())
+    config = get_config()
+    downloader = MusicDownloader(config, refresh=args.refresh)
     tracks = downloader.get_bookmarked_tracks()
 
     console.print("[blue]i[/blue] Retrieving music from bookmarks...")
-    console.print(f"[blue]i[/blue] Found {len(tracks)} tracks to download\n")
+    tracks = downloader.filter_tracks(tracks)
+    console.print(f"[blue]i[/blue] Found {len(tracks)} tracks to download")
+
+    console.print("[blue]i[/blue] Retrieving metadata from Spotify...")
+    tracks_metadata = downloader.get_spotify_metadata_bulk(tracks)
+    console.print(f"[blue]i[/blue] Found metadata for {sum(1 for m in tracks_metadata.values() if m)} tracks\n")
 
     # Setup progress bars
     progress = Progress(
@@ -184,21 +578,15 @@ def main():
     with progress:
         overall_task = progress.add_task(f"[cyan]Processing {len(tracks)} tracks", total=len(tracks))
 
-        for track in tracks:
-            process_task = progress.add_task(f"[green]Processing: '{track.name}'", total=100)
-
-            if downloader.download_track(track, process_task, progress):
-                console.print(f"[green]✓[/green] Successfully downloaded: '{track.name}'")
-                downloader.convert_to_mp3(track, process_task, progress)
-                console.print(f"[green]✓[/green] Successfully converted")
-                if metadata := downloader.get_spotify_metadata(track):
-                    downloader.add_metadata(track.name, metadata)
-                    console.print(f"[green]✓[/green] Successfully added metadata\n")
-                else:
-                    console.print(f"[yellow]![/yellow] No Spotify metadata found\n")
-
-            progress.update(overall_task, advance=1)
-            progress.remove_task(process_task)
+        # Every stage is I/O-bound (yt-dlp, Spotify, covers) or runs in ffmpeg, so tracks are processed concurrently
+        with ThreadPoolExecutor(max_workers=config.MAX_WORKERS) as executor:
+            futures = [
+                executor.submit(process_track, downloader, track, tracks_metadata[track], progress)
+                for track in tracks
+            ]
+            for future in as_completed(futures):
+                future.result()
+                progress.update(overall_task, advance=1)
 
         progress.remove_task(overall_task)
     console.print("[green]✓[/green] All tracks processed!")
@@ -0,0 +1,252 @@
+import json
+import random
+from concurrent.futures import Future
+
+import pytest
+import requests
+from mutagen.id3 import ID3, TIT2
+
+from config import Config, Pattern
+import main
+from main import MusicDownloader, Track, TrackMetadata, resolve_cover, levenshtein_similarity, best_match_index
+
+
+def make_downloader(music_dir, bookmark_path: str = "", bookmark_position: int = 0) -> MusicDownloader:
+    config = Config(
+        SPOTIFY_CLIENT_ID="client-id",
+        SPOTIFY_CLIENT_SECRET="client-secret",
+        FFMPEG_PATH="/usr/bin/ffmpeg",
+        CHROME_BOOKMARK_PATH=bookmark_path,
+        BOOKMARK_POSITION=bookmark_position,
+        MUSIC_DIRECTORY=str(music_dir),
+        MAX_WORKERS=2,
+        SPOTIFY_WORKERS=1,
+        SPOTIFY_CACHE_TTL_DAYS=180,
+        NAMING_PATTERN=Pattern(artist=0, title=1, separator=" - "),
+    )
+    return MusicDownloader(config)
+
+
+def make_track(name: str, url: str) -> Track:
+    return Track.from_chrome_bookmark(dict(name=name, url=url), Pattern(artist=0, title=1, separator=" - "))
+
+
+def test_filter_tracks_empty_music_dir(tmp_path):
+    downloader = make_downloader(tmp_path)
+    tracks = [
+        make_track("Sum 41 - In Too Deep", "https://youtu.be/1"),
+        make_track("Linkin Park - Shadow of the Day", "https://youtu.be/2"),
+    ]
+
+    assert downloader.filter_tracks(tracks) == tracks
+
+
+def test_filter_tracks_keeps_mp3_with_corrupt_id3_header(tmp_path):
+    downloader = make_downloader(tmp_path)
+    track = make_track("Sum 41 - In Too Deep", "https://youtu.be/1")
+    downloader.mp3_path(track).write_bytes(b"ID3\x03\x00\x00\xff\xff\xff\xff" + b"\x00" * 64)
+
+    assert downloader.filter_tracks([track]) == [track]
+
+
+def write_tags(filepath, *frames):
+    filepath.touch()
+    tags = ID3()
+    for frame in frames:
+        tags.add(frame)
+    tags.save(filepath, v2_version=3)
+
+
+def test_filter_tracks_skips_tagged_mp3_without_cover(tmp_path):
+    downloader = make_downloader(tmp_path)
+    track = make_track("Sum 41 - In Too Deep", "https://youtu.be/1")
+    write_tags(downloader.mp3_path(track), TIT2(encoding=3, text="In Too Deep"))
+
+    # The cached metadata has no cover, so no APIC frame is expected
+    metadata = TrackMetadata(year="2001", title="In Too Deep", album="All Killer No Filler", artist="Sum 41")
+    downloader.metadata_cache.set(downloader._search_query(track), downloader.SEARCH_LIMIT, metadata)
+
+    assert downloader.filter_tracks([track]) == []
+
+
+def test_filter_tracks_keeps_tagged_mp3_missing_its_cover(tmp_path):
+    downloader = make_downloader(tmp_path)
+    track = make_track("Sum 41 - In Too Deep", "https://youtu.be/1")
+    write_tags(downloader.mp3_path(track), TIT2(encoding=3, text="In Too Deep"))
+
+    metadata = TrackMetadata(
+        year="2001",
+        title="In Too Deep",
+        album="All Killer No Filler",
+        artist="Sum 41",
+        cover_url="https://i.scdn.co/image/cover",
+    )
+    downloader.metadata_cache.set(downloader._search_query(track), downloader.SEARCH_LIMIT, metadata)
+
+    assert downloader.filter_tracks([track]) == [track]
+
+
+def test_filter_tracks_skips_downloaded_unmatched_track(tmp_path):
+    downloader = make_downloader(tmp_path)
+    track = make_track("Unknown - Unreleased", "https://youtu.be/1")
+    downloader.mp3_path(track).touch()
+    downloader.metadata_cache.set(downloader._search_query(track), downloader.SEARCH_LIMIT, None)
+
+    assert downloader.filter_tracks([track]) == []
+
+
+def test_filter_tracks_keeps_unmatched_track_not_downloaded(tmp_path):
+    downloader = make_downloader(tmp_path)
+    track = make_track("Unknown - Unreleased", "https://youtu.be/1")
+    downloader.metadata_cache.set(downloader._search_query(track), downloader.SEARCH_LIMIT, None)
+
+    assert downloader.filter_tracks([track]) == [track]
+
+
+def test_unmatched_track_is_not_searched_again(tmp_path):
+    downloader = make_downloader(tmp_path)
+    track = make_track("Unknown - Unreleased", "https://youtu.be/1")
+    downloader.metadata_cache.set(downloader._search_query(track), downloader.SEARCH_LIMIT, None)
+
+    def search(*args, **kwargs):
+        raise AssertionError("Spotify should not be searched")
+
+    downloader._search_spotify = search
+
+    assert downloader.get_spotify_metadata(track) is None
+
+
+def test_failed_cover_still_writes_text_tags(tmp_path):
+    downloader = make_downloader(tmp_path)
+    track = make_track("Sum 41 - In Too Deep", "https://youtu.be/1")
+    filepath = downloader.mp3_path(track)
+    filepath.touch()
+
+    cover = Future()
+    cover.set_exception(requests.Timeout("cover timed out"))
+    metadata = TrackMetadata(year="2001", title="In Too Deep", album="All Killer No Filler", artist="Sum 41")
+    downloader.add_metadata(filepath, metadata, resolve_cover(track, cover))
+
+    tags = ID3(filepath)
+    assert tags["TIT2"].text == ["In Too Deep"]
+    assert "APIC:Cover" not in tags
+
+
+def test_filter_tracks_dedupes_on_safe_name(tmp_path):
+    downloader = make_downloader(tmp_path)
+    tracks = [
+        make_track("AC/DC - X", "https://youtu.be/1"),
+        make_track("AC:DC - X", "https://youtu.be/2"),
+    ]
+
+    assert downloader.filter_tracks(tracks) == tracks[:1]
+
+
+def full_matrix_similarity(s1: str, s2: str) -> float:
+    rows = [[i + j if i * j == 0 else 0 for j in range(len(s2) + 1)] for i in range(len(s1) + 1)]
+    for i in range(1, len(s1) + 1):
+        for j in range(1, len(s2) + 1):
+            rows[i][j] = min(rows[i - 1][j] + 1, rows[i][j - 1] + 1, rows[i - 1][j - 1] + (s1[i - 1] != s2[j - 1]))
+    max_len = max(len(s1), len(s2))
+    return 1 - rows[-1][-1] / max_len if max_len else 1.0
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_levenshtein_similarity_matches_full_matrix(seed):
+    rng = random.Random(seed)
+    for _ in range(500):
+        s1 = "".join(rng.choices("abc", k=rng.randint(0, 8)))
+        s2 = "".join(rng.choices("abc", k=rng.randint(0, 8)))
+        max_len = max(len(s1), len(s2)) or 1
+        # Cutoffs landing exactly on a reachable score, and arbitrary ones
+        score_cutoff = rng.choice([1 - rng.randint(0, max_len) / max_len, rng.random(), 0.0])
+
+        similarity = full_matrix_similarity(s1, s2)
+        expected = similarity if similarity >= score_cutoff - 1e-9 else 0.0
+        assert levenshtein_similarity(s1, s2, score_cutoff=score_cutoff) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("s1, s2, score_cutoff, expected", [
+    ("", "", 0.0, 1.0),
+    ("sum 41", "sum 41", 1.0, 1.0),
+    ("sum 41", "sum 14", 0.0, 4 / 6),
+    ("sum 41", "sum 14", 0.7, 0.0),
+    ("abcab", "bcab", 0.8, 0.8),
+    ("a", "abcdef", 0.5, 0.0),
+])
+def test_levenshtein_similarity_cutoff(s1, s2, score_cutoff, expected):
+    assert levenshtein_similarity(s1, s2, score_cutoff=score_cutoff) == pytest.approx(expected)
+
+
+@pytest.fixture(params=["rapidfuzz", "fallback"])
+def matcher(request, monkeypatch):
+    if request.param == "rapidfuzz":
+        if main.rapidfuzz_process is None:
+            pytest.skip("rapidfuzz is not installed")
+    else:
+        monkeypatch.setattr(main, "rapidfuzz_process", None)
+    return best_match_index
+
+
+@pytest.mark.parametrize("query, choices, expected", [
+    ("linkin park", ["linkin park", "linkin parc"], 0),
+    ("linkin park", ["park", "linkin parc", "linkin park"], 2),
+    ("sum 41", ["sum 14", "sum 14"], 0),
+    ("sum 41", ["xyz", "zyx"], 0),
+])
+def test_best_match_index(matcher, query, choices, expected):
+    assert matcher(query, choices) == expected
+
+
+def write_bookmarks(filepath, *folders):
+    """ Minimal Chrome `Bookmarks` file holding the given bookmark bar folders """
+
+    bookmark_bar = dict(children=[
+        dict(name=name, type="folder", children=[dict(name=title, type="url", url=url) for title, url in children])
+        for name, children in folders
+    ], name="Bookmarks bar", type="folder")
+    filepath.write_text(json.dumps(dict(checksum="", roots=dict(bookmark_bar=bookmark_bar), version=1)))
+
+
+@pytest.fixture(params=["ijson", "orjson", "json"])
+def bookmarks_parser(request, monkeypatch):
+    if request.param == "ijson":
+        if main.ijson is None:
+            pytest.skip("ijson is not installed")
+        return
+
+    monkeypatch.setattr(main, "ijson", None)
+    if request.param == "orjson":
+        if main.orjson is None:
+            pytest.skip("orjson is not installed")
+    else:
+        monkeypatch.setattr(main, "orjson", None)
+
+
+@pytest.mark.parametrize("position, expected", [
+    (0, [dict(name="Work", type="url", url="https://example.com")]),
+    (2, [
+        dict(name="Linkin Park - Numb", type="url", url="https://youtu.be/1"),
+        dict(name="Sum 41 - In Too Deep", type="url", url="https://youtu.be/2"),
+    ]),
+])
+def test_iter_music_folder(tmp_path, bookmarks_parser, position, expected):
+    bookmark_path = tmp_path / "Bookmarks"
+    write_bookmarks(
+        bookmark_path,
+        ("Work", [("Work", "https://example.com")]),
+        ("Empty", []),
+        ("Music", [("Linkin Park - Numb", "https://youtu.be/1"), ("Sum 41 - In Too Deep", "https://youtu.be/2")]),
+    )
+    downloader = make_downloader(tmp_path, str(bookmark_path), position)
+
+    assert list(downloader._iter_music_folder()) == expected
+
+
+def test_iter_music_folder_position_out_of_range(tmp_path, bookmarks_parser):
+    bookmark_path = tmp_path / "Bookmarks"
+    write_bookmarks(bookmark_path, ("Music", [("Linkin Park - Numb", "https://youtu.be/1")]))
+    downloader = make_downloader(tmp_path, str(bookmark_path), 1)
+
+    with pytest.raises(IndexError):
+        list(downloader._iter_music_folder())